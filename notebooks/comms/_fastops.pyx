@@ -0,0 +1,103 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+
+# File: _fastops.pyx - compiled inner loops for modulation mapping;
+#       an alternative to the numba kernels in _kernels.py that needs no runtime dependency
+
+"""
+# comms._fastops
+
+Cython versions of the modulation mapping and demapping loops in `comms._kernels`, with the
+same interface. The extension must be built before it can be used, e.g., from within the
+`comms` directory:
+
+    cythonize -i _fastops.pyx
+
+If the extension is not built, `comms.mod_mapping` uses the numba kernels (if numba is
+installed) or NumPy.
+"""
+
+import numpy as np
+
+# symbols are real-valued for real-valued constellations (e.g., BPSK and PAM), complex otherwise
+ctypedef fused symbol_t:
+    double
+    double complex
+
+#
+# modulation mapping
+#
+def mod_map(const unsigned char[::1] bits, const symbol_t[::1] lut, int K):
+    """map groups of K bits (MSB first) to symbols
+
+    Inputs:
+    -------
+    bits: vector of 0's and 1's (`uint8`); length must be a multiple of K
+    lut: vector of symbols indexed by key (`float64` or `complex128`)
+    K: number of bits per symbol
+
+    Returns:
+    --------
+    vector of symbols
+    """
+    cdef Py_ssize_t N = bits.shape[0] // K
+    cdef Py_ssize_t n, k, key
+
+    if symbol_t is double:
+        syms = np.empty(N, dtype=np.float64)
+    else:
+        syms = np.empty(N, dtype=np.complex128)
+    cdef symbol_t[::1] out = syms
+
+    for n in range(N):
+        key = 0
+        for k in range(K):
+            key = (key << 1) | bits[n*K + k]
+        out[n] = lut[key]
+
+    return syms
+
+def demap(const double[::1] syms_re, const double[::1] syms_im,
+          const double[::1] const_re, const double[::1] const_im,
+          const unsigned char[:, ::1] bit_lut):
+    """find the bit patterns of the constellation points closest to the received symbols
+
+    Inputs:
+    -------
+    syms_re, syms_im: real and imaginary parts of the received symbols (`float64`)
+    const_re, const_im: real and imaginary parts of the constellation points (`float64`)
+    bit_lut: (M, K) array of bit patterns; row `k` belongs to constellation point `k`
+
+    Returns:
+    --------
+    vector of bits
+    """
+    cdef Py_ssize_t N = syms_re.shape[0]
+    cdef Py_ssize_t M = bit_lut.shape[0]
+    cdef Py_ssize_t K = bit_lut.shape[1]
+    cdef Py_ssize_t n, k, j, min_k
+    cdef double s_re, s_im, dr, di, d2, min_d
+
+    bits = np.empty(N*K, dtype=np.uint8)
+    cdef unsigned char[::1] out = bits
+
+    for n in range(N):
+        s_re = syms_re[n]
+        s_im = syms_im[n]
+
+        # start with the first constellation point and search the others
+        dr = s_re - const_re[0]
+        di = s_im - const_im[0]
+        min_d = dr*dr + di*di
+        min_k = 0
+        for k in range(1, M):
+            dr = s_re - const_re[k]
+            di = s_im - const_im[k]
+            d2 = dr*dr + di*di
+            if d2 < min_d:
+                min_d = d2
+                min_k = k
+
+        for j in range(K):
+            out[n*K + j] = bit_lut[min_k, j]
+
+    return bits
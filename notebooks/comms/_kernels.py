@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+
+# File: _kernels.py - compiled inner loops;
+#       requires numba; the other modules fall back to NumPy if numba is not installed
+
+"""
+# comms._kernels
+
+Numba-compiled versions of inner loops used in the other modules. Importing this module
+raises an `ImportError` if numba is not installed.
+
+Functions are compiled when they are first called; compiled code is cached on disk so that
+the compilation cost is paid only once.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+#
+# modulation mapping
+#
+@njit(cache=True, parallel=True)
+def mod_map(bits, lut, K):
+    """map groups of K bits (MSB first) to symbols
+
+    Inputs:
+    -------
+    bits: vector of 0's and 1's (`uint8`); length must be a multiple of K
+    lut: vector of symbols indexed by key
+    K: number of bits per symbol
+
+    Returns:
+    --------
+    vector of symbols
+    """
+    N = bits.shape[0] // K
+    syms = np.empty(N, dtype=lut.dtype)
+
+    for n in prange(N):
+        key = 0
+        for k in range(K):
+            key = (key << 1) | bits[n*K + k]
+        syms[n] = lut[key]
+
+    return syms
+
+@njit(cache=True, fastmath=True, parallel=True)
+def demap(syms_re, syms_im, const_re, const_im, bit_lut):
+    """find the bit patterns of the constellation points closest to the received symbols
+
+    Inputs:
+    -------
+    syms_re, syms_im: real and imaginary parts of the received symbols (`float64`)
+    const_re, const_im: real and imaginary parts of the constellation points (`float64`)
+    bit_lut: (M, K) array of bit patterns; row `k` belongs to constellation point `k`
+
+    Returns:
+    --------
+    vector of bits
+    """
+    N = syms_re.shape[0]
+    M, K = bit_lut.shape
+    bits = np.empty(N*K, dtype=np.uint8)
+
+    for n in prange(N):
+        s_re = syms_re[n]
+        s_im = syms_im[n]
+
+        # start with the first constellation point and search the others
+        dr = s_re - const_re[0]
+        di = s_im - const_im[0]
+        min_d = dr*dr + di*di
+        min_k = 0
+        for k in range(1, M):
+            dr = s_re - const_re[k]
+            di = s_im - const_im[k]
+            d2 = dr*dr + di*di
+            if d2 < min_d:
+                min_d = d2
+                min_k = k
+
+        for j in range(K):
+            bits[n*K + j] = bit_lut[min_k, j]
+
+    return bits
+
+#
+# pulse shaping
+#
+@njit(cache=True, fastmath=True)
+def convolve(x, h, out):
+    """add the full linear convolution of a signal `x` and a (short) pulse `h` to `out`
+
+    Inputs:
+    -------
+    x, h: sequences to convolve
+    out: output vector of length len(x) + len(h) - 1; must be initialized (usually to zeros)
+
+    Returns:
+    --------
+    nothing; the result is accumulated in `out`
+    """
+    # the inner loop runs over the (long) signal so that it can be vectorized
+    for k in range(h.shape[0]):
+        hk = h[k]
+        for n in range(x.shape[0]):
+            out[n + k] += x[n] * hk
@@ -7,6 +7,7 @@
 # Modulation Mapping
 
 This module provides tables (dicts) for mapping groups of bits to symbols and functions to perform this mapping.
+The tables are `Constellation` objects: dictionaries that also store their contents as arrays.
 Additionally, there are some functions to pretty-print or plot a constellation.
 
 ## Constellations:
@@ -38,6 +39,16 @@ import matplotlib.pyplot as plt
 
 from comms.utils import int_to_bits, bits_to_int
 
+# compiled inner loops are used if available: the Cython extension `comms._fastops` if it
+# has been built, otherwise the numba kernels if numba is installed
+try:
+    from comms import _fastops as _kernels
+except ImportError:
+    try:
+        from comms import _kernels
+    except ImportError:
+        _kernels = None
+
 #
 # Constellations
 #
@@ -55,6 +66,164 @@ _8pam_map = lambda b: (1-2*b[0])*(4-(1-2*b[1])*(2-(1-2*b[2])))
 # 8PSK
 _8psk_map = lambda b: np.exp(1j*np.pi/8*(1-2*b[0])*(4-(1-2*b[1])*(2-(1-2*b[2]))))
 
+#
+# Constellation objects
+#
+class Constellation(dict):
+    """a dictionary mapping groups of bits to symbols, with array copies of its contents
+
+    A `Constellation` behaves like the dictionary it is constructed from. In addition, it
+    stores its contents as arrays indexed by key, for use in vectorized functions:
+    * `symbols`: the symbols (`complex128`)
+    * `re`, `im`: real and imaginary parts of the symbols (`float64`)
+    * `bits`: array of shape (M, K); row `n` holds the K bits of key `n` (`uint8`)
+    * `K`: the number of bits per symbol
+    * `is_complex`: False if all symbols are real-valued (e.g., BPSK and PAM)
+
+    and functions specialized for this constellation, which are used by `mod_mapper` and `demodulator`:
+    * `fast_map(bits)`: map bits to symbols (`complex128`)
+    * `fast_map_real(bits)`: map bits to real-valued symbols (`float64`); only differs from
+      `fast_map` for real-valued constellations
+    * `fast_demap(syms)`: recover bits from received symbols
+
+    The arrays and functions are computed when the constellation is constructed; the dictionary
+    should not be modified afterwards.
+    """
+    def __init__(self, mod_table):
+        super().__init__(mod_table)
+
+        M = len(self)
+        self.K = int(np.log2(M))
+
+        self.symbols = np.array([self[k] for k in range(M)], dtype=np.complex128)
+        self.re = np.ascontiguousarray(self.symbols.real)
+        self.im = np.ascontiguousarray(self.symbols.imag)
+        self.is_complex = bool(np.any(self.im != 0))
+        self.bits = np.array([int_to_bits(k, self.K) for k in range(M)], dtype=np.uint8).reshape(M, self.K)
+
+        for arr in (self.symbols, self.re, self.im, self.bits):
+            arr.flags.writeable = False
+
+        self.fast_map = _compile_mapper(self, self.symbols)
+
+        # real-valued constellations can produce real-valued symbols; this halves the memory
+        # and the arithmetic in subsequent processing
+        if self.is_complex:
+            self.fast_map_real = self.fast_map
+        else:
+            self.fast_map_real = _compile_mapper(self, self.re)
+        self.fast_demap = _compile_demapper(self)
+
+    def __reduce__(self):
+        # the specialized functions cannot be pickled; they are rebuilt from the dictionary
+        return (Constellation, (dict(self),))
+
+def _as_constellation(mod_table):
+    """return `mod_table` as a `Constellation`; plain dictionaries are converted (for internal use)"""
+    if isinstance(mod_table, Constellation):
+        return mod_table
+
+    return Constellation(mod_table)
+
+#
+# specialized mapping and demapping functions
+#
+# Each constellation gets its own pair of functions. All decisions that depend only on the
+# constellation (bits per symbol, which implementation to use) are made once, when the functions
+# are built; the functions have the constellation's tables and constants bound to them.
+def _as_bits(bits):
+    """return `bits` as a contiguous `uint8` vector; raise ValueError unless all bits are 0 or 1 (for internal use)
+
+    The compiled kernels index the symbol table without bounds checks, so other values
+    must not reach them.
+    """
+    bits = np.asarray(bits)
+    if np.any((bits != 0) & (bits != 1)):
+        raise ValueError('bits must be 0 or 1')
+
+    return np.ascontiguousarray(bits, dtype=np.uint8)
+
+def _compile_mapper(mod_table, symbols):
+    """build the function mapping bits to `symbols`, the symbols of `mod_table` (for internal use)"""
+    K = mod_table.K
+
+    if _kernels is not None:
+        def fast_map(bits):
+            return _kernels.mod_map(_as_bits(bits), symbols, K)
+
+        return fast_map
+
+    # group the bits into rows of K bits and convert each row to an integer key (MSB first)
+    # with these weights; then look up the symbols for all keys at once
+    weights = 1 << np.arange(K-1, -1, -1, dtype=np.uint32)
+
+    def fast_map(bits):
+        keys = _as_bits(bits).reshape(-1, K) @ weights
+        return symbols[keys]
+
+    return fast_map
+
+def _compile_demapper(mod_table):
+    """build the demodulation function for `mod_table`, using a search over all points (for internal use)"""
+    if _kernels is not None:
+        re, im, bit_lut = mod_table.re, mod_table.im, mod_table.bits
+
+        def fast_demap(syms):
+            syms = np.asarray(syms)
+            return _kernels.demap(np.ascontiguousarray(syms.real, dtype=np.float64),
+                                  np.ascontiguousarray(syms.imag, dtype=np.float64),
+                                  re, im, bit_lut)
+
+        return fast_demap
+
+    def fast_demap(syms):
+        return _search_demap(np.asarray(syms), mod_table)
+
+    return fast_demap
+
+# number of distances (symbols x constellation points) computed at a time by the demodulator;
+# the two (block, M) matrices of 64-bit floats take 256 kB and stay in the L2 cache
+_DEMOD_BLOCK_SIZE = 1 << 14
+
+def _search_demap(syms, mod_table):
+    """find the bits of the constellation points closest to the received symbols (for internal use)"""
+    K = mod_table.K
+    
+    # how many bits will we get?
+    N = len(syms) * K
+    bits = np.zeros(N, dtype=np.uint8)
+    
+    # find the constellation point closest to each received symbol; to limit memory use,
+    # symbols are processed in blocks of B symbols, using the same scratch arrays for all
+    # blocks. The squared distance is sufficient for comparison; it is computed from real
+    # and imaginary parts to avoid complex temporaries. For real-valued constellations, the
+    # imaginary part of the received symbols is the same for all points and can be ignored.
+    M = len(mod_table)
+    B = max(1, _DEMOD_BLOCK_SIZE // M)
+    scratch_dr = np.empty((B, M))
+    scratch_di = np.empty((B, M))
+    scratch_k = np.empty(B, dtype=np.intp)
+
+    for n in range(0, len(syms), B):
+        block = syms[n : n+B]
+        dr = scratch_dr[:len(block)]
+        di = scratch_di[:len(block)]
+        min_k = scratch_k[:len(block)]
+
+        np.subtract(block.real[:, None], mod_table.re[None, :], out=dr)
+        np.multiply(dr, dr, out=dr)
+        if mod_table.is_complex:
+            np.subtract(block.imag[:, None], mod_table.im[None, :], out=di)
+            np.multiply(di, di, out=di)
+            np.add(dr, di, out=dr)
+        np.argmin(dr, axis=1, out=min_k)
+        
+        # the indices of the closest symbols are the integers `min_k`
+        # convert those to sequences of K bits
+        bits[n*K : (n+len(block))*K] = mod_table.bits[min_k].ravel()
+        
+    return bits
+
 #
 # use a *comprehension* to construct the corresponding dictionaries/tables
 #
@@ -63,50 +232,126 @@ _8psk_map = lambda b: np.exp(1j*np.pi/8*(1-2*b[0])*(4-(1-2*b[1])*(2-(1-2*b[2])))
 # * values eaual to the symbols
 #
 # length of the dictionary M = 2**K
+#
+# the dictionaries are wrapped in `Constellation` objects, which also hold array copies
  
-BPSK = {n: _bpsk_map(int_to_bits(n, 1)) for n in range(2)}
-QPSK = {n: _qpsk_map(int_to_bits(n, 2)) for n in range(4)}
-QAM16 = {n: _16qam_map(int_to_bits(n, 4)) for n in range(16)}
-QAM64 = {n: _64qam_map(int_to_bits(n, 6)) for n in range(64)}
+BPSK = Constellation({n: _bpsk_map(int_to_bits(n, 1)) for n in range(2)})
+QPSK = Constellation({n: _qpsk_map(int_to_bits(n, 2)) for n in range(4)})
+QAM16 = Constellation({n: _16qam_map(int_to_bits(n, 4)) for n in range(16)})
+QAM64 = Constellation({n: _64qam_map(int_to_bits(n, 6)) for n in range(64)})
 
-PAM4 = {n: _4pam_map(int_to_bits(n, 2)) for n in range(4)}
-PAM8 = {n: _8pam_map(int_to_bits(n, 3)) for n in range(8)}
+PAM4 = Constellation({n: _4pam_map(int_to_bits(n, 2)) for n in range(4)})
+PAM8 = Constellation({n: _8pam_map(int_to_bits(n, 3)) for n in range(8)})
 
-PSK8 = {n: _8psk_map(int_to_bits(n, 3)) for n in range(8)}
+PSK8 = Constellation({n: _8psk_map(int_to_bits(n, 3)) for n in range(8)})
 
 # a list of all constellations
 Constellations = [BPSK, QPSK, QAM16, QAM64, PAM4, PAM8, PSK8]
 
+#
+# separable constellations
+#
+# QPSK, 16-QAM and 64-QAM are the Cartesian product of two one-dimensional constellations
+# (BPSK, 4-PAM and 8-PAM, respectively): the real part of the symbol is determined by the bits
+# in even positions, the imaginary part by the bits in odd positions. Hence, the closest
+# constellation point can be found along the real and imaginary axis separately. Along each
+# axis, the bits are obtained by comparing the sample with fixed thresholds (see `_pam_demap`).
+def _pam_demap(x, K):
+    """find the bits of the 2**K-PAM levels closest to the real samples `x` (for internal use)
+
+    For the PAM constellations above, the first bit is the sign of the level. The remaining
+    bits follow from the magnitude: with t = 2**(K-1), levels with magnitude above t have the
+    second bit equal to 1; the third bit is found the same way from the distance of the magnitude
+    to t, with t halved, and so on. For 8-PAM, |x| > 4 and ||x| - 4| > 2 yield the last two bits.
+    Hence, no search over the levels is needed.
+
+    Returns an array with `len(x)` rows of K bits
+    """
+    # samples on a decision boundary go to the level with the lower key, like the search
+    # over all points; hence, -0.0 counts as positive
+    bits = np.zeros((len(x), K), dtype=np.uint8)
+    bits[:, 0] = x < 0
+
+    mag = np.abs(x)
+    for k in range(1, K):
+        t = 1 << (K-k)
+        bits[:, k] = mag > t
+        mag = np.abs(mag - t)
+
+    return bits
+
+def _compile_pam_demapper(K):
+    """build the demodulation function for 2**K-PAM (for internal use)"""
+    def fast_demap(syms):
+        return _pam_demap(np.asarray(syms).real, K).ravel()
+
+    return fast_demap
+
+def _compile_qam_demapper(K):
+    """build the demodulation function for the QAM with 2**K-PAM along each axis (for internal use)"""
+    def fast_demap(syms):
+        syms = np.asarray(syms)
+
+        # bits in even positions come from the real part, bits in odd positions from the imaginary part
+        bits = np.zeros((len(syms), 2*K), dtype=np.uint8)
+        bits[:, 0::2] = _pam_demap(syms.real, K)
+        bits[:, 1::2] = _pam_demap(syms.imag, K)
+
+        return bits.ravel()
+
+    return fast_demap
+
+BPSK.fast_demap = _compile_pam_demapper(BPSK.K)
+PAM4.fast_demap = _compile_pam_demapper(PAM4.K)
+PAM8.fast_demap = _compile_pam_demapper(PAM8.K)
+QPSK.fast_demap = _compile_qam_demapper(BPSK.K)
+QAM16.fast_demap = _compile_qam_demapper(PAM4.K)
+QAM64.fast_demap = _compile_qam_demapper(PAM8.K)
+
+#
+# 8-PSK
+#
+# The phase of the 8-PSK symbol with key n equals pi/8 times the 8-PAM level with key n. Since all
+# symbols have the same magnitude, the closest symbol is the one with the closest phase; hence, the
+# bits follow from the phase in units of pi/8 exactly like for 8-PAM. The phase lies between -pi and pi,
+# i.e., between -8 and 8 in units of pi/8, and the decision boundary between the levels 7 and -7 is at
+# +/- pi, where the phase wraps around.
+def _psk8_demap(syms):
+    """demodulate 8-PSK symbols from their phase (for internal use)"""
+    return _pam_demap(np.angle(np.asarray(syms)) * (8/np.pi), PAM8.K).ravel()
+
+PSK8.fast_demap = _psk8_demap
+
 #
 # Modulation mapper
 #
-def mod_mapper(bits, mod_table):
+def mod_mapper(bits, mod_table, real=False):
     """map a sequence of bits to a sequence of symbols
     
     Inputs:
     -------
     * bits: sequence of 0's and 1's
     * mod_table: dictionary containing the mapping from groups of bits to symbols
+    * real: if True, symbols from real-valued constellations (BPSK, PAM) are returned as real
+      numbers (`float64`) rather than complex (default: False).
+      **Note:** `channels.dgnc` adds real-valued noise with the full variance to real symbols,
+      whereas complex symbols receive half the variance in the real part.
 
     Returns:
     --------
-    a vector of symbols
+    a vector of symbols (`complex128`, or `float64` if `real` is True and the constellation is real-valued)
     """
+    mod_table = _as_constellation(mod_table)
     
     # how many bits per symbol?
-    K = int( np.log2(len(mod_table)) )
+    K = mod_table.K
 
     assert len(bits) % K == 0, "number of bits must bedivisible by number of bit per symbol"
     
-    # how many symbols will we get?
-    N = len(bits) // K
-    syms = np.zeros(N, dtype=complex)
+    if real:
+        return mod_table.fast_map_real(bits)
     
-    for n in range(N):
-        key = bits_to_int(bits[K*n : K*(n+1)])
-        syms[n] = mod_table[key]
-        
-    return syms
+    return mod_table.fast_map(bits)
 
 def demodulator(syms, mod_table):
     """Recover bit sequence from received symbols
@@ -120,29 +365,7 @@ def demodulator(syms, mod_table):
     --------
     a vector of bits
     """
-    # how many bits per symbol?
-    K = int( np.log2(len(mod_table)) )
-    
-    # how many bits will we get?
-    N = len(syms) * K
-    bits = np.zeros(N, dtype=np.uint8)
-    
-    # find the constellation point closest to received symb `s`
-    for n in range(len(syms)):
-        s = syms[n]
-        min_d = np.infty
-        min_k = -1
-        for k,v in mod_table.items():
-            dist = np.abs(s - v)
-            if dist < min_d:
-                min_d = dist
-                min_k = k
-                
-        # the index of the closest symbol is integer `min_k`
-        # convert that to a sequence of K bits
-        bits[n*K : (n+1)*K] = int_to_bits(min_k, K)
-        
-    return bits
+    return _as_constellation(mod_table).fast_demap(syms)
 
 #
 # Helper functions:
@@ -266,6 +489,29 @@ if __name__ == "__main__":
         rec_bits = demodulator(syms, mm)
         assert bits_to_int(rec_bits) == N
 
+    # the specialized demappers must agree with a search over all constellation points,
+    # in particular for noisy symbols near the decision boundaries
+    rng = np.random.default_rng(1)
+    for mm in Constellations:
+        bits = rng.integers(0, 2, 3000 * mm.K)
+        syms = mod_mapper(bits, mm)
+        for sigma in [0.1, 0.5, 2.0]:
+            rx = syms + sigma * (rng.standard_normal(len(syms)) + 1j * rng.standard_normal(len(syms)))
+            assert np.array_equal(mm.fast_demap(rx), _search_demap(rx, mm))
+            assert np.array_equal(mm.fast_demap(rx.real), _search_demap(rx.real, mm))
+
+    # bits other than 0 and 1 are rejected
+    for bad_bits in [[0, 2], [1, -1], [0.5, 0]]:
+        try:
+            mod_mapper(bad_bits, QPSK)
+            assert False, "invalid bits were accepted"
+        except ValueError:
+            pass
+
+    # 8-PSK: phases close to +/- pi, where the phase wraps around
+    rx = rng.uniform(0.5, 1.5, 3000) * np.exp(1j * (np.pi + rng.uniform(-0.5, 0.5, 3000)))
+    assert np.array_equal(PSK8.fast_demap(rx), _search_demap(rx, PSK8))
+
     # print_constellation(PAM8)
     # plot_constellation(QAM16)
 
@@ -29,15 +29,32 @@ of digitally modulated signals
 """
 
 
+from functools import lru_cache
+
 import numpy as np
 
+# compiled inner loops are used if numba is installed
+try:
+    from comms import _kernels
+except ImportError:
+    _kernels = None
+
 #
 # Various pulse shapes
 #
 # Note: pulses may be scaled to produce samples of a continuous-time pulse or like a discrete-time pulse.
 # For a continuous-time pulse, the integral over the square of the pulse equals 1. For a discrete-time pulse,
 # the sum over the square of the samples equals 1
+#
+# The same few pulses tend to be requested over and over; they are computed once and cached.
+# Cached pulses are returned as read-only arrays.
 
+def _read_only(pp):
+    """mark array `pp` as read-only and return it (for internal use)"""
+    pp.flags.writeable = False
+    return pp
+
+@lru_cache(maxsize=32)
 def sine_squared_pulse(fsT, fs=1):
     """synthesize a sine squared pulse
     
@@ -49,13 +66,14 @@ def sine_squared_pulse(fsT, fs=1):
 
     Returns:
     --------
-    pulse of length fsT samples
+    pulse of length fsT samples (read-only)
     """
     nn = np.arange(fsT)
     pp = np.sqrt(8*fs/(3*fsT)) * np.sin(np.pi * nn/fsT)**2
 
-    return pp
+    return _read_only(pp)
 
+@lru_cache(maxsize=32)
 def rect_pulse(fsT, fs=1):
     """synthesize a rectangular pulse
     
@@ -67,12 +85,13 @@ def rect_pulse(fsT, fs=1):
 
     Returns:
     --------
-    pulse of length fsT samples
+    pulse of length fsT samples (read-only)
     """
     pp = np.sqrt(fs/(fsT)) * np.ones(fsT)
 
-    return pp
+    return _read_only(pp)
 
+@lru_cache(maxsize=32)
 def half_sine_pulse(fsT, fs=1):
     """synthesize a half-sine pulse
     
@@ -84,12 +103,12 @@ def half_sine_pulse(fsT, fs=1):
 
     Returns:
     --------
-    pulse of length fsT samples
+    pulse of length fsT samples (read-only)
     """
     nn = np.arange(fsT)
     pp = np.sqrt(2*fs/(fsT)) * np.sin(np.pi * nn/fsT)
 
-    return pp
+    return _read_only(pp)
 
 def rc_pulse(a, fsT, fs=1, N=5):
     """Construct a raised cosine pulse
@@ -165,6 +184,69 @@ def srrc_pulse(a, fsT, fs=1, N=5):
 #
 # pulse shaping
 #
+# for long pulses, convolution is faster in the frequency domain. The cost of direct convolution
+# grows with the length of the shorter sequence, the cost of the FFT only with the logarithm
+# of the total length; the crossover is at a few hundred samples.
+_FFT_CONV_MIN_LEN = 256
+
+# for short pulses, a compiled direct convolution avoids the per-call overhead of
+# np.convolve and the conversion of real pulses to complex for complex signals
+_NUMBA_CONV_MAX_LEN = 64
+
+# Spectra of pulses are cached for reuse when many blocks are shaped with the same pulse.
+# Since the FFT length grows with the signal length, only spectra with at most
+# _PULSE_FFT_CACHE_MAX_LEN points (1 MB as complex128) are cached, and at most
+# _PULSE_FFT_CACHE_SIZE of them; the cache therefore never exceeds 8 MB. Longer
+# spectra are computed on every call.
+_PULSE_FFT_CACHE_MAX_LEN = 1 << 16
+_PULSE_FFT_CACHE_SIZE = 8
+
+def _pulse_fft(h, n_fft, real):
+    """FFT of length `n_fft` of the pulse `h`; `rfft` if `real` is True (for internal use)"""
+    if n_fft > _PULSE_FFT_CACHE_MAX_LEN:
+        return np.fft.rfft(h, n_fft) if real else np.fft.fft(h, n_fft)
+
+    return _cached_pulse_fft(h.tobytes(), h.dtype, n_fft, real)
+
+@lru_cache(maxsize=_PULSE_FFT_CACHE_SIZE)
+def _cached_pulse_fft(h_bytes, dtype, n_fft, real):
+    """FFT of length `n_fft` of the pulse stored in `h_bytes` (for internal use)
+
+    The pulse is passed as bytes so that repeated pulse shaping with the same pulse
+    and signal length reuses the transform. For real signals and pulses, only the
+    non-negative frequencies (`rfft`) are computed.
+    """
+    h = np.frombuffer(h_bytes, dtype=dtype)
+    HH = np.fft.rfft(h, n_fft) if real else np.fft.fft(h, n_fft)
+
+    HH.flags.writeable = False
+    return HH
+
+def _convolve(x, h):
+    """compute the full linear convolution of a signal `x` and a pulse `h` (for internal use)
+
+    Direct convolution is used when either sequence is short; otherwise, the convolution
+    is computed via the FFT.
+    """
+    if _kernels is not None and len(h) < _NUMBA_CONV_MAX_LEN:
+        out = np.zeros(len(x) + len(h) - 1, dtype=np.result_type(x.dtype, h.dtype))
+        _kernels.convolve(x, h, out)
+        return out
+
+    if min(len(x), len(h)) < _FFT_CONV_MIN_LEN:
+        return np.convolve(x, h)
+
+    # zero-pad to a power of 2 that avoids circular wrap-around
+    L = len(x) + len(h) - 1
+    n_fft = 1 << (L-1).bit_length()
+
+    if np.iscomplexobj(x) or np.iscomplexobj(h):
+        HH = _pulse_fft(h, n_fft, False)
+        return np.fft.ifft(np.fft.fft(x, n_fft) * HH)[:L]
+    else:
+        HH = _pulse_fft(h, n_fft, True)
+        return np.fft.irfft(np.fft.rfft(x, n_fft) * HH, n_fft)[:L]
+
 def pulse_shape(syms, pp, fsT):
     """perform pulse shaping for a sequence of symbols
     
@@ -178,13 +260,18 @@ def pulse_shape(syms, pp, fsT):
     --------
     vector of signal samples; length is equal to (len(syms)-1)*fsT + len(pp)
     """
-    # upsample the symbol sequence
-    N_dd = (len(syms)-1) *fsT + 1  # this avoids extra zeros at end
-    dd = np.zeros(N_dd, dtype=syms.dtype)
-    dd[0::fsT] = syms
+    # Upsampling followed by filtering is computed in polyphase form: output samples
+    # with index n*fsT + i depend only on every fsT-th pulse sample, starting with pp[i].
+    # Convolving the symbols with these shorter sub-pulses avoids inserting fsT-1 zeros
+    # between symbols and multiplying them with the pulse.
+    pp = np.asarray(pp)
+    N_out = (len(syms)-1) * fsT + len(pp)
+    out = np.zeros(N_out, dtype=np.result_type(syms.dtype, pp.dtype))
+
+    for i in range(min(fsT, len(pp))):
+        out[i::fsT] = _convolve(syms, pp[i::fsT])
 
-    # convolve with pulse
-    return np.convolve(dd, pp)
+    return out
 
 #
 # Bandwidth computations
@@ -230,8 +317,11 @@ def bandwidth_zz(ff, SS):
     peak = SS[loc]
 
     # search for the first time, we get close to zero
-    while(SS[loc] > 1e-4 * peak):
-        loc += 1
+    near_zero = SS[loc:] <= 1e-4 * peak
+    if not np.any(near_zero):
+        raise ValueError('spectrum has no zero above the peak frequency')
+
+    loc += np.argmax(near_zero)
 
     # ff[loc] is either a positive or negative frequency where S(f) = 0.*peak
     # 3dB bandwidth is twice the absolute value of this quantity
@@ -257,12 +347,9 @@ def bandwidth_containment(ff, SS, alpha):
     loc = np.argmax(SS)
     peak = SS[loc]
 
-    acc = peak/2
-    loc += 1
-    # accumulate power untile we get to alpha*P
-    while(acc < alpha * P/2):
-        acc += SS[loc]
-        loc += 1
+    # accumulate power until we get to alpha*P/2; acc[m] is the power up to m samples above the peak
+    acc = np.cumsum(np.concatenate(([peak/2], SS[loc+1:])))
+    loc += 1 + np.searchsorted(acc, alpha * P/2)
 
     # ff[loc] is either a positive or negative frequency where S(f) = 0.*peak
     # 3dB bandwidth is twice the absolute value of this quantity
@@ -302,3 +389,30 @@ def numerical_FT(pp, fs, N):
 
     return PP
 
+
+
+if __name__ == "__main__":
+    # compare pulse shaping against upsampling followed by direct convolution
+    def upsample_and_convolve(syms, pp, fsT):
+        dd = np.zeros((len(syms)-1) * fsT + 1, dtype=syms.dtype)
+        dd[0::fsT] = syms
+        return np.convolve(dd, pp)
+
+    rng = np.random.default_rng(1)
+    tests = [
+        (half_sine_pulse(8), 8),            # len(pp) == fsT
+        (np.ones(3), 4),                    # len(pp) < fsT
+        (srrc_pulse(0.5, 8, 8, 5), 8),      # len(pp) not a multiple of fsT
+        (rc_pulse(0.3, 2, 1, 200), 2),      # long sub-pulses: FFT convolution
+        (rect_pulse(1), 1),                 # no upsampling
+    ]
+    for pp, fsT in tests:
+        for N in [1, 5, 1000]:
+            for syms in [rng.standard_normal(N), rng.standard_normal(N) + 1j * rng.standard_normal(N)]:
+                sig = pulse_shape(syms, pp, fsT)
+                ref = upsample_and_convolve(syms, pp, fsT)
+                assert sig.dtype == ref.dtype and len(sig) == len(ref)
+                assert np.allclose(sig, ref)
+
+    # all good if we get here
+    print('OK')
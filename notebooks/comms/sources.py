@@ -11,6 +11,7 @@ This module contains various functions that act as sources or sinks for bit sequ
 ## Sources:
 
 * `string_source( string )`: convert a string to a sequence of bits
+* `random_bit_source( N, rng )`: produce a sequence of N random bits
 
 ## Sinks:
 
@@ -20,7 +21,8 @@ This module contains various functions that act as sources or sinks for bit sequ
 
 import numpy as np
 
-from comms.utils import byte_to_bits, bits_to_byte
+# random number generator used by `random_bit_source` when no generator or seed is given
+_rng = np.random.default_rng()
 
 def string_source(string):
     """convert a string to a vector of bits
@@ -34,16 +36,30 @@ def string_source(string):
     Numpy vector of bits
     """
     # convert a string to a sequence of bytes
-    bb = string.encode()
-    Nb = len(bb)
+    bb = np.frombuffer(string.encode(), dtype=np.uint8)
     
-    # allocate space
-    bits = np.zeros(8 * Nb, dtype=np.uint8)
+    # unpack each byte into 8 bits (MSB first)
+    return np.unpackbits(bb)
+
+def random_bit_source(N, rng=None):
+    """produce a sequence of random bits
     
-    for n in range(Nb):
-        bits[8*n : 8*(n+1)] = byte_to_bits(bb[n])
-        
-    return bits
+    Inputs:
+    -------
+    * N - number of bits; 0's and 1's are equally likely and independent
+    * rng - (optional) seed (int) or `np.random.Generator` for reproducible bit sequences; by default,
+      a module-level generator is used. **Note:** `np.random.seed()` does not affect this function.
+
+    Returns:
+    --------
+    Numpy vector of N bits; the `dtype` of this vector is `uint8`
+    """
+    if rng is None:
+        rng = _rng
+    else:
+        rng = np.random.default_rng(rng)
+
+    return rng.integers(0, 2, size=N, dtype=np.uint8)
 
 def string_sink(bits):
     """convert a sequence of bits into a string
@@ -61,12 +77,8 @@ def string_sink(bits):
     if len(bits) % 8 != 0:
         raise ValueError(f'number of bits {len(bits)} is not divisible by 8.')
     
-    # allocate storage
-    n_bytes = len(bits) // 8
-    bytes = np.zeros(n_bytes, dtype=np.uint8)
-
-    for n in range(n_bytes):
-        bytes[n] = bits_to_byte(bits[n*8 : (n+1)*8])
+    # pack groups of 8 bits (MSB first) into bytes
+    bytes = np.packbits(np.asarray(bits, dtype=np.uint8))
 
     # decode the string (deal with unicode encoding)
     return bytes.tobytes().decode("utf-8", "replace")
@@ -77,5 +89,14 @@ if __name__ == "__main__":
     string = "Hi 😲"
     assert string == string_sink( string_source(string) )
 
+    ## random bits
+    bits = random_bit_source(800)
+    assert bits.dtype == np.uint8 and len(bits) == 800
+    assert np.all((bits == 0) | (bits == 1))
+
+    # seeded sequences are reproducible
+    assert np.array_equal(random_bit_source(100, 7), random_bit_source(100, 7))
+    assert np.array_equal(random_bit_source(100, np.random.default_rng(7)), random_bit_source(100, 7))
+
     # all good if we get here
     print('OK')
\ No newline at end of file
@@ -107,6 +107,32 @@ def int_to_bits(nn: int, K: int):
         
     return bits
 
+#
+# error counting
+#
+def count_errors(tx, rx, epsilon=1e-6):
+    """count the positions where two sequences differ
+    
+    Inputs:
+    -------
+    tx: transmitted sequence (e.g., bits or symbols); bits may be integers or booleans
+    rx: received sequence; must have the same length as `tx`
+    epsilon: for non-integer sequences, elements are considered different if they differ by more
+        than `epsilon` (default: 1e-6)
+
+    Returns:
+    --------
+    (int) the number of errors
+    """
+    tx = np.asarray(tx)
+    rx = np.asarray(rx)
+
+    # boolean and integer sequences (bits) can be compared exactly
+    if tx.dtype.kind in 'biu' and rx.dtype.kind in 'biu':
+        return int(np.count_nonzero(tx != rx))
+
+    return int(np.count_nonzero(np.abs(rx - tx) > epsilon))
+
 
 if __name__ == "__main__":
     # round-trip test of bits_to_byte and byte_to_bits
@@ -118,5 +144,10 @@ if __name__ == "__main__":
     for n in range(2**K):
         assert bits_to_int( int_to_bits(n, K) ) == n
 
+    # error counting for bits and for symbols
+    assert count_errors(np.array([0, 1, 1, 0], dtype=np.uint8), np.array([0, 1, 0, 1])) == 2
+    assert count_errors(np.array([1+1j, -1-1j]), np.array([1+1j, -1+1j])) == 1
+    assert count_errors(np.array([0, 1, 1, 0], dtype=np.uint8), np.array([-1., 2., -3., 4.]) > 0) == 2
+
     # all good if we get here
     print('OK')
\ No newline at end of file